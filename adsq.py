@@ -17,13 +17,16 @@ entries. Everything else will be treated as a search query.
         https://ui.adsabs.harvard.edu/help/api/
 """
 import argparse
+import base64
 import logging
 import json
 import dataclasses
+import functools
+import heapq
+import urllib.error
 import urllib.request
 import urllib.parse
 import http.client
-import re
 import os
 
 from enum import Enum
@@ -33,14 +36,19 @@ ADS_EXPORT_BIBTEX_URL = "https://api.adsabs.harvard.edu/v1/export/bibtex"
 ADS_TOKEN = os.environ.get("ADS_TOKEN")
 ADS_BIBTEX_URL = "https://api.adsabs.harvard.edu/v1/export/bibtex"
 MAX_AUTHORS = 4
-BIBCODE_PATTERN = r"^[a-zA-Z0-9]+\.+[a-zA-Z0-9]+\.+[a-zA-Z0-9]+$"
+ADS_DATABASES = ("astronomy", "physics", "general", "earthscience")
 
 logger = logging.getLogger(__name__)
 
+# reused across NASA/ADS requests, see `_ads_request`
+_connection: None | http.client.HTTPSConnection = None
+
 
 class InvalidQuery(Exception): ...
 
 
+# built once: the token cannot change while running
+@functools.lru_cache(maxsize=1)
 def _get_auth_header() -> dict[str, str]:
     if not ADS_TOKEN:
         print(
@@ -64,10 +72,83 @@ DO NOT SHARE YOUR TOKEN WITH ANYONE.
     return {"Authorization": "Bearer " + ADS_TOKEN}
 
 
+def _ads_connection(host: str) -> http.client.HTTPSConnection:
+    # honour `https_proxy` like `urllib.request.urlopen` does, by tunnelling
+    # through the proxy
+    proxy = urllib.request.getproxies().get("https")
+    if not proxy or urllib.request.proxy_bypass(host):
+        return http.client.HTTPSConnection(host)
+
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    parts = urllib.parse.urlsplit(proxy)
+
+    headers = {}
+    if parts.username:
+        credentials = urllib.parse.unquote(parts.username) + ":"
+        credentials += urllib.parse.unquote(parts.password or "")
+        headers["Proxy-Authorization"] = (
+            "Basic " + base64.b64encode(credentials.encode()).decode()
+        )
+
+    conn = http.client.HTTPSConnection(parts.hostname, parts.port or 80)
+    conn.set_tunnel(host, headers=headers)
+    return conn
+
+
+def _ads_request(url: str, body: None | bytes = None) -> http.client.HTTPResponse:
+    """
+    Make a request to NASA/ADS over a persistent (keep-alive) connection, so
+    that repeated calls do not each pay for a new TCP and TLS handshake. A
+    `body` makes it a POST request, otherwise it is a GET.
+
+    The response must be read in full before the next request is made.
+    """
+    global _connection
+
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    method = "GET" if body is None else "POST"
+    headers = _get_auth_header()
+    if body is not None:
+        headers = {**headers, "Content-Type": "application/json"}
+
+    for attempt in range(2):
+        if _connection is None:
+            _connection = _ads_connection(parts.netloc)
+        try:
+            _connection.request(method, path, body=body, headers=headers)
+            resp = _connection.getresponse()
+            break
+        except (http.client.HTTPException, ConnectionError):
+            # the server may have closed an idle connection: retry once on a
+            # fresh one
+            _connection.close()
+            _connection = None
+            if attempt:
+                raise
+
+    if resp.status >= 400:
+        resp.read()
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+
+    return resp
+
+
 def _url_escape(s: str) -> str:
     return urllib.parse.quote_plus(s, safe="^")
 
 
+def _is_year(year: str) -> bool:
+    # a year, or a range of years such as `2010-2020` or `2010-`
+    parts = year.split("-")
+    return (
+        len(parts) <= 2
+        and any(parts)
+        and all(p == "" or (p.isascii() and p.isdigit()) for p in parts)
+    )
+
+
 @dataclasses.dataclass
 class ADSQuery:
     terms: None | list[str] = None
@@ -75,6 +156,15 @@ class ADSQuery:
     year: None | str = None
     database: None | str = None
 
+    def __post_init__(self):
+        # year and database go into the query unescaped, so only URL-safe
+        # values are accepted
+        if self.year is not None and not _is_year(self.year):
+            raise InvalidQuery(f"Invalid year '{self.year}'.")
+
+        if self.database is not None and self.database not in ADS_DATABASES:
+            raise InvalidQuery(f"Unknown database '{self.database}'.")
+
     def is_valid(self) -> bool:
         # year enough is not enough to perform a search
         return self.authors or self.terms
@@ -85,14 +175,13 @@ class ADSQuery:
             q.append(_url_escape(" ".join(self.terms)))
 
         if self.authors:
-            for author in self.authors:
-                q.append("author:" + _url_escape(author))
+            q.extend("author:" + _url_escape(author) for author in self.authors)
 
         if self.year:
-            q.append("year:" + _url_escape(self.year))
+            q.append("year:" + self.year)
 
         if self.database:
-            q.append("database:" + _url_escape(self.database))
+            q.append("database:" + self.database)
 
         return "&fq=".join(q)
 
@@ -161,31 +250,33 @@ def pretty_print_doc(doc: dict):
     padding = max(len(i[0]) for i in s) + 2
     space = " " * padding
 
-    text = ""
+    parts: list[str] = []
     for k, lines in s:
-        text += k.rjust(padding) + ": "
+        parts.append(k.rjust(padding) + ": ")
         if len(lines) > 1:
-            for i, v in enumerate(lines):
-                if i == 0:
-                    text += "- " + str(v) + "\n"
-                else:
-                    text += space + "  - " + str(v) + "\n"
+            parts.append("- " + str(lines[0]) + "\n")
+            for v in lines[1:]:
+                parts.append(space + "  - " + str(v) + "\n")
         else:
-            text += str(lines[0]) + "\n"
+            parts.append(str(lines[0]) + "\n")
 
-    print(text)
+    print("".join(parts))
 
 
-def _ads_search_query(query: str, fields: str) -> http.client.HTTPResponse:
+def _ads_search_query(
+    query: str, fields: str, top: None | int = None
+) -> http.client.HTTPResponse:
     encoded_query = "?q=" + query + "&fl=" + fields
+    if top is not None:
+        # ask for the most cited records, rather than the default handful of
+        # most relevant ones
+        encoded_query += f"&rows={top}&sort=citation_count+desc"
 
     req_url = ADS_QUERY_URL + encoded_query
 
     logger.debug("Making query: %s", req_url)
 
-    req = urllib.request.Request(req_url, headers=_get_auth_header())
-
-    return urllib.request.urlopen(req)
+    return _ads_request(req_url)
 
 
 def _ads_export_bibcode(bibcode: list[str]) -> str:
@@ -195,22 +286,20 @@ def _ads_export_bibcode(bibcode: list[str]) -> str:
 
     logger.debug("Making query: %s", req_url)
 
-    req = urllib.request.Request(req_url, headers=_get_auth_header(), data=body)
-
-    return urllib.request.urlopen(req)
+    return _ads_request(req_url, body=body)
 
 
-def ads_search(query: str, fields: str) -> str:
-    resp = _ads_search_query(query, fields)
-    return resp.read().decode()
+def ads_search(query: str, fields: str, top: None | int = None) -> bytes:
+    resp = _ads_search_query(query, fields, top)
+    return resp.read()
 
 
-def ads_export(bibcode: list[str]) -> str:
+def ads_export(bibcode: list[str]) -> bytes:
     resp = _ads_export_bibcode(bibcode)
-    return resp.read().decode()
+    return resp.read()
 
 
-def run_query(query: ADSQuery, fields: str, as_json: bool):
+def run_query(query: ADSQuery, fields: str, as_json: bool, top: None | int = None):
     logger.debug("Query object: %s", query)
 
     if not query.is_valid():
@@ -219,21 +308,48 @@ def run_query(query: ADSQuery, fields: str, as_json: bool):
     q = query.format_ads()
     logger.debug("Formatted query: %s", q)
 
-    data = ads_search(q, fields)
+    data = ads_search(q, fields, top)
 
     if as_json:
-        print(data)
+        print(data.decode())
         return
 
     d = json.loads(data)
     docs = d["response"]["docs"]
 
-    for doc in sorted(docs, key=lambda x: x.get("citation_count", 0)):
+    def _citations(doc):
+        return doc.get("citation_count", 0)
+
+    if top is not None:
+        # most cited last, as with the full listing
+        docs = reversed(heapq.nlargest(top, docs, key=_citations))
+    else:
+        docs = sorted(docs, key=_citations)
+
+    for doc in docs:
         pretty_print_doc(doc)
 
 
 def is_bibcode(term: str) -> bool:
-    return re.match(BIBCODE_PATTERN, term) is not None
+    # three ASCII alphanumeric runs, separated by one or more `.`
+    parts = term.split(".")
+    runs = [p for p in parts if p]
+    return (
+        len(runs) == 3
+        and parts[0] != ""
+        and parts[-1] != ""
+        and all(p.isascii() and p.isalnum() for p in runs)
+    )
+
+
+def _positive_int(value: str) -> int:
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an integer: '{value}'")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
 
 
 def fetch_bibtex(terms: list[str], as_json: bool):
@@ -241,7 +357,7 @@ def fetch_bibtex(terms: list[str], as_json: bool):
     data = ads_export(terms)
 
     if as_json:
-        print(data)
+        print(data.decode())
         return
 
     d = json.loads(data)
@@ -271,6 +387,12 @@ if __name__ == "__main__":
         help="Force interpretation of the argument as a bibcode",
     )
     parser.add_argument("terms", nargs="*")
+    parser.add_argument(
+        "--top",
+        type=_positive_int,
+        default=None,
+        help="Only show the TOP most cited results.",
+    )
     parser.add_argument(
         "--fields",
         help="Which fields to request",
@@ -280,6 +402,7 @@ if __name__ == "__main__":
         "--database",
         help="Which databse to request from.",
         default="astronomy",
+        choices=ADS_DATABASES,
     )
     args = parser.parse_args()
 
@@ -294,4 +417,4 @@ if __name__ == "__main__":
         fetch_bibtex(args.terms, args.json)
     else:
         query = ADSQuery(args.terms, args.author, args.year, args.database)
-        run_query(query, args.fields, args.json)
+        run_query(query, args.fields, args.json, top=args.top)
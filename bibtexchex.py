@@ -46,37 +46,89 @@ The other output file contains those entries that either:
         https://ui.adsabs.harvard.edu/help/api/
 """
 import argparse
+import base64
+import contextlib
+import functools
 import logging
+import mmap
 import re
 import pathlib
 import json
-import dataclasses
+import urllib.error
 import urllib.request
 import urllib.parse
 import http.client
 import itertools
 import os
+import sqlite3
+import stat
+import threading
 import time
+import concurrent.futures
 
-from enum import Enum
-
-CITE_REGEX = r"\\cite(t|p|alp|alt)?(\[([^\]]*)\])*\{(?P<citation>[^\}]+)\}"
-BIB_REGEX = r"@\w+\{(?P<citation>[^\},]+)"
+CITE_REGEX = rb"\\cite(?:t|p|alp|alt)?(?:\[[^\]]*\])*\{(?P<citation>[^\}]+)\}"
+BIB_REGEX = rb"@\w+\{(?P<citation>[^\},]+)"
 ADS_QUERY_URL = "https://api.adsabs.harvard.edu/v1/search/query"
 ADS_TOKEN = os.environ.get("ADS_TOKEN")
 ADS_BIBTEX_URL = "https://api.adsabs.harvard.edu/v1/export/bibtex"
 QUERY_SLEEP = 0.2
+QUERY_WORKERS = 8
+# number of identifiers looked up by a single NASA/ADS search
+QUERY_BATCH_SIZE = 50
+CACHE_PATH = (
+    pathlib.Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser()
+    / "tex-tech"
+    / "ads.sqlite3"
+)
+# seconds before a cached NASA/ADS response is fetched again, so that records
+# that have since changed (e.g. preprints that got published) are picked up
+CACHE_TTL = 7 * 24 * 60 * 60
+
+_CITE_RE = re.compile(CITE_REGEX, re.MULTILINE)
+# a whole entry, from its type and label up to the first line holding only `}`.
+# lines are skipped whole, and never past the start of the next entry, so an
+# entry without such a line fails fast instead of searching to the end of file
+_BIB_ENTRY_RE = re.compile(
+    BIB_REGEX + rb"(?:(?!\s*@)[^\n]*\n)*?^\s*}\s*$", re.MULTILINE
+)
+# the fields of an entry that may hold an identifier for the item itself
+_FIELD_RE = re.compile(r"\b(adsurl|doi|note|url|journal)\s*=\s*\{(?P<info>[^\}]+)}")
+# every identifier we know how to find in a note or url, in a single pass
+_IDENTIFIER_RE = re.compile(
+    r"arXiv:\s?(?P<arxiv_id>\d+\.\d+)"
+    r"|ADS Bibcode:\s?(?P<ads_note>[^\s]+)"
+    r"|arxiv\.org\/(?:abs|pdf)\/(?P<arxiv_url>[^\s\/]+)"
+    r"|adsabs\.harvard\.edu\/abs\/(?P<ads_url>[^\s\/]+)"
+)
+# a new-style arXiv identifier with its version, e.g. `2101.00001v2`
+_ARXIV_VERSION_RE = re.compile(r"^(\d{4}\.\d{4,5})v\d+$")
+# maps the `_IDENTIFIER_RE` group names onto NASA/ADS query fields
+_QUERY_FIELDS = {
+    "arxiv_id": "arXiv",
+    "arxiv_url": "arXiv",
+    "ads_note": "bibcode",
+    "ads_url": "bibcode",
+}
 
 logger = logging.getLogger(__name__)
 
+# holds a `connection` reused across NASA/ADS requests made from the same
+# thread, see `_ads_request`
+_local = threading.local()
+
 
 class AmbiguousBibNodeError(Exception): ...
 
 
+class UnresolvedQueryError(Exception): ...
+
+
 def _unescape_bibcode(code: str) -> str:
     return code.replace("\\&", "&")
 
 
+# built once: the token cannot change while running
+@functools.lru_cache(maxsize=1)
 def _get_auth_header() -> dict[str, str]:
     if not ADS_TOKEN:
         print(
@@ -100,91 +152,321 @@ DO NOT SHARE YOUR TOKEN WITH ANYONE.
     return {"Authorization": "Bearer " + ADS_TOKEN}
 
 
+def _ads_connection(host: str) -> http.client.HTTPSConnection:
+    # honour `https_proxy` like `urllib.request.urlopen` does, by tunnelling
+    # through the proxy
+    proxy = urllib.request.getproxies().get("https")
+    if not proxy or urllib.request.proxy_bypass(host):
+        return http.client.HTTPSConnection(host)
+
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    parts = urllib.parse.urlsplit(proxy)
+
+    headers = {}
+    if parts.username:
+        credentials = urllib.parse.unquote(parts.username) + ":"
+        credentials += urllib.parse.unquote(parts.password or "")
+        headers["Proxy-Authorization"] = (
+            "Basic " + base64.b64encode(credentials.encode()).decode()
+        )
+
+    conn = http.client.HTTPSConnection(parts.hostname, parts.port or 80)
+    conn.set_tunnel(host, headers=headers)
+    return conn
+
+
+def _ads_request(url: str, body: None | bytes = None) -> http.client.HTTPResponse:
+    """
+    Make a request to NASA/ADS over a persistent (keep-alive) connection, so
+    that repeated calls do not each pay for a new TCP and TLS handshake. A
+    `body` makes it a POST request, otherwise it is a GET.
+
+    Each thread has its own connection. The response must be read in full
+    before the same thread makes its next request.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    method = "GET" if body is None else "POST"
+    headers = _get_auth_header()
+    if body is not None:
+        headers = {**headers, "Content-Type": "application/json"}
+
+    for attempt in range(2):
+        conn = getattr(_local, "connection", None)
+        if conn is None:
+            conn = _local.connection = _ads_connection(parts.netloc)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            break
+        except (http.client.HTTPException, ConnectionError):
+            # the server may have closed an idle connection: retry once on a
+            # fresh one
+            conn.close()
+            _local.connection = None
+            if attempt:
+                raise
+
+    if resp.status >= 400:
+        resp.read()
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+
+    return resp
+
+
 def ads_get_bibtex(bibcodes: list[str]) -> http.client.HTTPResponse:
     payload = {"bibcode": bibcodes, "sort": "first_author asc"}
-    req = urllib.request.Request(
-        ADS_BIBTEX_URL, headers=_get_auth_header(), data=json.dumps(payload).encode()
-    )
-    return urllib.request.urlopen(req)
+    return _ads_request(ADS_BIBTEX_URL, body=json.dumps(payload).encode())
 
 
 def ads_make_bib(bibcodes: list[str]) -> str:
     resp = ads_get_bibtex(bibcodes)
-    return json.loads(resp.read().decode())["export"]
+    return json.loads(resp.read())["export"]
 
 
-def ads_search_query(data: dict[str, str]) -> http.client.HTTPResponse:
-    query = " ".join(k + ":" + v for (k, v) in data.items())
-    encoded_query = "?" + urllib.parse.urlencode({"q": query, "fl": "bibcode,title"})
+class _Cache:
+    """
+    A persistent key-value store for the results of NASA/ADS calls, so that
+    re-running the script does not repeat identical searches and exports.
+    Entries older than `ttl` seconds are treated as missing. Safe to share
+    between threads.
+    """
 
-    req_url = ADS_QUERY_URL + encoded_query
-    req = urllib.request.Request(req_url, headers=_get_auth_header())
+    def __init__(self, path: pathlib.Path, ttl: float = CACHE_TTL):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ads_responses "
+                "(key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
 
-    return urllib.request.urlopen(req)
+    def get(self, key: str) -> None | str:
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value FROM ads_responses WHERE key = ? AND created > ?",
+                    (key, time.time() - self._ttl),
+                ).fetchone()
+        except sqlite3.Error as e:
+            # treat an unreadable cache as a miss rather than failing the run
+            logger.warning("Could not read from cache: %s", e)
+            return None
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: str):
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ads_responses VALUES (?, ?, ?)",
+                    (key, value, time.time()),
+                )
+        except sqlite3.Error as e:
+            # not being able to cache should never fail the run
+            logger.warning("Could not write to cache: %s", e)
 
+    def get_or_set(self, key: str, loader) -> str:
+        """
+        Returns the value stored for `key`, or calls `loader` and stores what
+        it returns. Nothing is stored if `loader` raises.
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
 
-def ads_search_bibcode(data: dict[str, str]) -> str:
-    resp = ads_search_query(data)
-    data = json.loads(resp.read().decode())
-    bibcodes = [i["bibcode"] for i in data["response"]["docs"]]
-    return bibcodes[0]
+    def close(self):
+        self._db.close()
 
 
-class NodeType(Enum):
-    CITATION = 0
-    BIBENTRY = 0
+def _open_cache(path: None | pathlib.Path) -> None | _Cache:
+    if not path:
+        return None
 
+    try:
+        return _Cache(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Warning: not using the cache at '{path}' ({e})")
+        return None
 
-@dataclasses.dataclass
-class Node:
-    start: int
-    end: int
-    node_type: NodeType
-    value: str
 
-    def __hash__(self) -> str:
-        return hash(self.value)
+def _normalise_identifier(field: str, identifier: str) -> str:
+    identifier = identifier.strip().lower()
+    # only arXiv identifiers drop their prefix and version: a DOI may well
+    # end in something that looks like a version
+    if field == "arXiv":
+        identifier = identifier.removeprefix("arxiv:")
+        identifier = _ARXIV_VERSION_RE.sub(r"\1", identifier)
+    return identifier
 
-    def __eq__(self, other) -> str:
-        return self.value.__eq__(other.value)
 
+def _escape_term(value: str) -> str:
+    # backslashes first, so that those escaping quotes are left alone
+    return value.replace("\\", "\\\\").replace('"', '\\"')
 
-def tex_all_citations(contents: str) -> list[Node]:
-    nodes = []
 
-    for item in re.finditer(CITE_REGEX, contents, re.MULTILINE):
-        for k in item.group("citation").split(sep=","):
-            nodes.append(Node(item.start(), item.end(), NodeType.CITATION, k.strip()))
+def ads_search_identifiers(field: str, values: list[str]) -> dict[str, str]:
+    """
+    Search NASA/ADS for many identifiers of the same kind (e.g. `doi` or
+    `arXiv`) with a single query. Returns a map from each (normalised)
+    identifier of the records found to their bibcode.
+    """
+    terms = " OR ".join('"' + _escape_term(v) + '"' for v in values)
+    encoded_query = "?" + urllib.parse.urlencode(
+        {
+            "q": f"{field}:({terms})",
+            "fl": "bibcode,doi,identifier",
+            "rows": 2 * len(values),
+        }
+    )
 
-    return nodes
+    resp = _ads_request(ADS_QUERY_URL + encoded_query)
+    data = json.loads(resp.read())
 
+    found = {}
+    for doc in data["response"]["docs"]:
+        for i in itertools.chain(doc.get("doi", []), doc.get("identifier", [])):
+            found.setdefault(_normalise_identifier(field, i), doc["bibcode"])
+    return found
 
-def bib_all_citations(contents: str) -> list[Node]:
-    nodes = []
 
-    items = re.finditer(BIB_REGEX, contents, re.MULTILINE)
-    ends = re.finditer(r"^\s*}\s*$", contents, re.MULTILINE)
+def _throttled_search_identifiers(field: str, values: list[str]) -> dict[str, str]:
+    try:
+        return ads_search_identifiers(field, values)
+    finally:
+        # keep each worker from hammering the API
+        time.sleep(QUERY_SLEEP)
 
-    for item, end in zip(items, ends):
-        nodes.append(
-            Node(item.start(), end.end(), NodeType.BIBENTRY, item.group("citation"))
-        )
 
-    return nodes
+def _resolve_batch(field: str, values: list[str]) -> list[str | Exception]:
+    """
+    Returns the bibcode or the exception for each of `values`. If the search
+    for the whole batch fails, each identifier is retried on its own, so that
+    one bad identifier does not fail the rest.
+    """
+    try:
+        found = _throttled_search_identifiers(field, values)
+    except Exception as e:
+        if len(values) == 1:
+            return [e]
+        return [r for v in values for r in _resolve_batch(field, [v])]
+
+    results: list[str | Exception] = []
+    for value in values:
+        bibcode = found.get(_normalise_identifier(field, value))
+        if bibcode is None:
+            results.append(UnresolvedQueryError(f"No record for {field}:{value}"))
+        else:
+            results.append(bibcode)
+    return results
+
+
+def ads_search_bibcodes(
+    queries: list[dict[str, str]], cache: None | _Cache = None
+) -> list[str | Exception]:
+    """
+    Resolve many queries to bibcodes. Each query is resolved by its DOI if it
+    has one, otherwise by its arXiv identifier. Identifiers of the same kind
+    are looked up `QUERY_BATCH_SIZE` at a time, with up to `QUERY_WORKERS`
+    searches running at once. Returns the bibcode or the exception for each
+    query, in the same order as `queries`.
+
+    Queries already in the `cache` are not sent to NASA/ADS.
+    """
+    results: list[str | Exception] = [None] * len(queries)
+    keys = ["search:" + json.dumps(q, sort_keys=True) for q in queries]
+
+    # indices of the queries still to resolve, grouped by the field to use and
+    # then by identifier, so that each identifier is only searched for once
+    pending: dict[str, dict[str, list[int]]] = {}
+    for i, q in enumerate(queries):
+        if cache is not None and (bibcode := cache.get(keys[i])) is not None:
+            results[i] = bibcode
+        else:
+            field = "doi" if "doi" in q else "arXiv"
+            pending.setdefault(field, {}).setdefault(q[field], []).append(i)
+
+    batches = [
+        (field, values[j : j + QUERY_BATCH_SIZE])
+        for field, values in ((f, list(v)) for f, v in pending.items())
+        for j in range(0, len(values), QUERY_BATCH_SIZE)
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(QUERY_WORKERS) as pool:
+        futures = {
+            pool.submit(_resolve_batch, field, batch): (field, batch)
+            for field, batch in batches
+        }
+        done = len(queries) - sum(len(v) for p in pending.values() for v in p.values())
+        errors = 0
+        for fut in concurrent.futures.as_completed(futures):
+            field, batch = futures[fut]
+            for value, result in zip(batch, fut.result()):
+                for i in pending[field][value]:
+                    results[i] = result
+                    if cache is not None and not isinstance(result, Exception):
+                        cache.set(keys[i], result)
+
+                    errors += isinstance(result, Exception)
+                    done += 1
+
+            print(f"Done {done} of {len(queries)} (errors = {errors})", end="\r")
+
+    return results
+
+
+@contextlib.contextmanager
+def _map_file(path: str):
+    """
+    Memory-map the file at `path` read-only, so it can be searched with the
+    (bytes) regex patterns without first reading and decoding it in full.
+    """
+    with open(path, "rb") as f:
+        # empty files cannot be mapped, and pipes (e.g. process substitution)
+        # cannot be mapped at all
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+            yield f.read()
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
 
 
-def check_cits(tex_cits: set[Node], bib_cits: set[Node]):
-    return [i for i in bib_cits if i in tex_cits], tex_cits.difference(bib_cits)
+def tex_all_citations(contents: bytes) -> set[str]:
+    labels = set()
 
+    # `citation` is the only group, so `findall` gives just the label lists
+    for citation in _CITE_RE.findall(contents):
+        for k in citation.split(sep=b","):
+            labels.add(k.strip().decode())
 
-def findfirst(expr: re.Pattern, text: str) -> None | re.Match:
-    matches = [i for i in re.finditer(expr, text)]
-    if matches:
-        return matches[0]
-    return None
+    return labels
 
 
-def bib_extract_query(bib: str, node: Node) -> dict[str, str]:
+def bib_all_citations(contents: bytes) -> dict[str, tuple[int, int]]:
+    """
+    Returns the `(start, end)` span of each entry, keyed by label. Only the
+    first entry with a given label is kept.
+    """
+    spans = {}
+
+    for item in _BIB_ENTRY_RE.finditer(contents):
+        spans.setdefault(item.group("citation").decode(), (item.start(), item.end()))
+
+    return spans
+
+
+def check_cits(tex_cits: set[str], bib_cits: dict[str, tuple[int, int]]):
+    needed = [(k, start, end) for k, (start, end) in bib_cits.items() if k in tex_cits]
+    return needed, tex_cits.difference(bib_cits.keys())
+
+
+def bib_extract_query(bib: bytes, start: int, end: int) -> dict[str, str]:
     """
     Tries to extract information that could be used to unambiguously resolve
     the item in NASA/ADS.
@@ -196,45 +478,19 @@ def bib_extract_query(bib: str, node: Node) -> dict[str, str]:
 
     Will raise an `AmbiguousBibNodeError` if no data could be found.
     """
-    details = bib[node.start : node.end]
-
-    fields = re.finditer(
-        r"\b(adsurl|doi|note|url|journal)\s*=\s*\{(?P<info>[^\}]+)}", details
-    )
+    details = bib[start:end].decode()
 
     query = {}
-    for i in fields:
-        _type = i.group(1)
-
-        if _type == "doi":
+    for i in _FIELD_RE.finditer(details):
+        if i.group(1) == "doi":
             query["doi"] = i.group("info")
+            continue
 
-        elif _type == "note" or _type == "journal":
-            note = i.group("info")
-
-            arxiv = findfirst(r"arXiv:\s?(?P<identifier>\d+\.\d+)", note)
-            if arxiv:
-                query["arXiv"] = arxiv.group("identifier")
-
-            bibcode = findfirst(r"ADS Bibcode:\s?(?P<identifier>[^ ]+)", note)
-            if bibcode:
-                query["bibcode"] = bibcode.group("identifier")
-
-        elif _type == "url" or _type == "adsurl":
-            url = i.group("info")
-
-            arxiv = findfirst(r"arxiv\.org\/(abs|pdf)\/(?P<identifier>[^ \/]+)", url)
-            if arxiv:
-                query["arXiv"] = arxiv.group("identifier")
-
-            bibcode = findfirst(
-                r"adsabs\.harvard\.edu\/abs\/(?P<identifier>[^ \/]+)", url
-            )
-            if bibcode:
-                query["bibcode"] = bibcode.group("identifier")
-
-        else:
-            raise "Unreachable"
+        # the first of each kind of identifier in a field value is used
+        found = {}
+        for m in _IDENTIFIER_RE.finditer(i.group("info")):
+            found.setdefault(_QUERY_FIELDS[m.lastgroup], m.group(m.lastgroup))
+        query.update(found)
 
     if len(query) == 0:
         raise AmbiguousBibNodeError("Could not extract query information")
@@ -242,103 +498,125 @@ def bib_extract_query(bib: str, node: Node) -> dict[str, str]:
     return {k: urllib.parse.unquote(v) for (k, v) in query.items()}
 
 
+def _write_entries(path: str, entries):
+    """
+    Write BibTeX `entries` (bytes) to `path`, separated by newlines, without
+    first joining them into one buffer.
+    """
+    with open(path, "wb") as f:
+        for i, entry in enumerate(entries):
+            if i:
+                f.write(b"\n")
+            f.write(entry)
+
+
 def main_entry(
     latex_file: str,
     bibtex_file: str,
     fetch_ads=True,
     outpath="output.bib",
     missing_outpath="missing.bib",
+    cache_path: None | pathlib.Path = CACHE_PATH,
 ):
-    contents = pathlib.Path(latex_file).read_text()
-    bib_contents = pathlib.Path(bibtex_file).read_text()
+    with _map_file(latex_file) as contents:
+        tex_cits = tex_all_citations(contents)
 
-    tex_cits = set(tex_all_citations(contents))
-    bib_cits = set(bib_all_citations(bib_contents))
+    with _map_file(bibtex_file) as bib_contents:
+        bib_cits = bib_all_citations(bib_contents)
 
-    needed, missing = check_cits(tex_cits, bib_cits)
+        needed, missing = check_cits(tex_cits, bib_cits)
 
-    failed: list[Node] = []
-    # list of bibcodes and what their label should be
-    bibcodes: list[tuple[str, str]] = []
-    # list of `needed` indices and corresponding queries
-    queries: list[tuple[int, dict[str, str]]] = []
+        print("Parsing summary:")
+        print(f" Unique citations  : {len(tex_cits)}")
+        print(f" BibTeX entries    : {len(bib_cits)}")
+        print(f" . needed entries  : {len(needed)}")
+        print(f" . missing entries : {len(missing)}")
 
-    for i, item in enumerate(needed):
-        try:
-            query = bib_extract_query(bib_contents, item)
-            if "bibcode" in query:
-                bibcodes.append((_unescape_bibcode(query["bibcode"]), item.value))
-            else:
-                queries.append((i, query))
-        except AmbiguousBibNodeError:
-            failed.append(item)
-
-    print("Parsing summary:")
-    print(f" Unique citations  : {len(tex_cits)}")
-    print(f" BibTeX entries    : {len(bib_cits)}")
-    print(f" . needed entries  : {len(needed)}")
-    print(f" . missing entries : {len(missing)}")
-    print(f" Missing ADS url   : {len(bibcodes) + len(queries) + len(failed)}")
-    print(f" . has bibcode     : {len(bibcodes)}")
-    print(f" . has query       : {len(queries)}")
-    print(f" . no query        : {len(failed)}")
-    print()
-
-    if not fetch_ads:
-        text = sorted([bib_contents[i.start : i.end] for i in needed])
-        with open(outpath, "w") as f:
-            f.write("\n".join(text))
-
-        print(f"Written '{outpath}'")
-
-    else:
-        print("Fetching from NASA/ADS")
-        errors = []
-        for i, (index, q) in enumerate(queries):
-            try:
-                bibcode = ads_search_bibcode(q)
-                bibcodes.append((_unescape_bibcode(bibcode), needed[index].value))
-            except Exception as e:
-                errors.append((index, q, e))
-
-            print(f"Done {i + 1} of {len(queries)} (errors = {len(errors)})", end="\r")
-            time.sleep(QUERY_SLEEP)
-
-        if errors:
-            print("ERRORS:")
-            for err in errors:
-                print(err)
-
-        missing_bib = [
-            bib_contents[i.start : i.end]
-            for i in itertools.chain(failed, (needed[i[0]] for i in errors))
-        ]
-
-        canonical_labels = {}
-        for code, label in bibcodes:
-            if code in canonical_labels:
-                print(
-                    f"Warning: '{label}' is a duplicate of '{canonical_labels[code]}' ({code})"
-                )
-            else:
-                canonical_labels[code] = label
+        if not fetch_ads:
+            print()
+            text = sorted([bib_contents[start:end] for (_, start, end) in needed])
+            _write_entries(outpath, text)
 
-        # fetch all of the bibcodes
-        new_bib = ads_make_bib(list(canonical_labels.keys()))
+            print(f"Written '{outpath}'")
 
-        # rewrite the labels
-        for code, label in canonical_labels.items():
-            new_bib = new_bib.replace(code, label, 1)
+        else:
+            # `(label, start, end)` of the entries that could not be resolved
+            failed: list[tuple[str, int, int]] = []
+            # list of bibcodes and what their label should be
+            bibcodes: list[tuple[str, str]] = []
+            # list of `needed` indices and corresponding queries
+            queries: list[tuple[int, dict[str, str]]] = []
+
+            for i, (label, start, end) in enumerate(needed):
+                try:
+                    query = bib_extract_query(bib_contents, start, end)
+                    if "bibcode" in query:
+                        bibcodes.append((_unescape_bibcode(query["bibcode"]), label))
+                    else:
+                        queries.append((i, query))
+                except AmbiguousBibNodeError:
+                    failed.append(needed[i])
+
+            print(f" Missing ADS url   : {len(bibcodes) + len(queries) + len(failed)}")
+            print(f" . has bibcode     : {len(bibcodes)}")
+            print(f" . has query       : {len(queries)}")
+            print(f" . no query        : {len(failed)}")
+            print()
+
+            print("Fetching from NASA/ADS")
+            # check for the token here, once, rather than in every worker
+            _get_auth_header()
+            cache = _open_cache(cache_path)
+
+            errors = []
+            results = ads_search_bibcodes([q for (_, q) in queries], cache)
+            for (index, q), bibcode in zip(queries, results):
+                if isinstance(bibcode, Exception):
+                    errors.append((index, q, bibcode))
+                else:
+                    bibcodes.append((_unescape_bibcode(bibcode), needed[index][0]))
+
+            if errors:
+                print("ERRORS:")
+                for err in errors:
+                    print(err)
+
+            canonical_labels = {}
+            for code, label in bibcodes:
+                if code in canonical_labels:
+                    print(
+                        f"Warning: '{label}' is a duplicate of '{canonical_labels[code]}' ({code})"
+                    )
+                else:
+                    canonical_labels[code] = label
+
+            # fetch all of the bibcodes
+            codes = list(canonical_labels.keys())
+            if cache is not None:
+                key = "export:" + ",".join(sorted(codes))
+                new_bib = cache.get_or_set(key, lambda: ads_make_bib(codes))
+                cache.close()
+            else:
+                new_bib = ads_make_bib(codes)
 
-        with open(outpath, "w") as f:
-            f.write(new_bib)
+            # rewrite the labels
+            for code, label in canonical_labels.items():
+                new_bib = new_bib.replace(code, label, 1)
 
-        print(f"Written '{outpath}'")
+            with open(outpath, "w") as f:
+                f.write(new_bib)
 
-        with open(missing_outpath, "w") as f:
-            f.write("\n".join(missing_bib))
+            print(f"Written '{outpath}'")
 
-        print(f"Written '{missing_outpath}'")
+            missing_bib = (
+                bib_contents[start:end]
+                for (_, start, end) in itertools.chain(
+                    failed, (needed[i[0]] for i in errors)
+                )
+            )
+            _write_entries(missing_outpath, missing_bib)
+
+            print(f"Written '{missing_outpath}'")
 
 
 if __name__ == "__main__":
@@ -364,6 +642,14 @@ if __name__ == "__main__":
         action="store_true",
         help="Do network requests to fetch missing data from NASA/ADS.",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=(
+            f"Do not read or write the NASA/ADS response cache at '{CACHE_PATH}'. "
+            f"Cached responses are otherwise reused for {CACHE_TTL // 3600} hours."
+        ),
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=args.loglevel.upper())
@@ -374,4 +660,5 @@ if __name__ == "__main__":
         fetch_ads=args.fetch,
         outpath=args.outfile,
         missing_outpath=args.missing_file,
+        cache_path=None if args.no_cache else CACHE_PATH,
     )